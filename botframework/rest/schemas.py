@@ -1,80 +1,99 @@
-"""Pydantic schemas for REST API payloads."""
+"""msgspec schemas for REST API payloads."""
 # pylint: disable=too-few-public-methods,import-error
 import time
 from typing import Dict, List, Optional, TypedDict, Union
 
-from pydantic import BaseModel, Field
+import msgspec
+
+# Unix timestamp used for ``created`` defaults. The worker refreshes it once
+# per second, so building a payload is a global read rather than a clock call.
+_cached_timestamp = int(time.time())
+
+def cached_timestamp() -> int:
+    """Return the most recently refreshed Unix timestamp."""
+    return _cached_timestamp
+
+def refresh_timestamp() -> None:
+    """Update the cached Unix timestamp from the system clock."""
+    global _cached_timestamp  # pylint: disable=global-statement
+    _cached_timestamp = time.time_ns() // 1_000_000_000
 
 class LlamaMessage(TypedDict):
     """llama.cpp chat message format."""
     role: str
     content: str
 
-class ChatMessage(BaseModel):
+# Nested leaf types are plain TypedDicts: they are only ever reached through
+# the Struct payloads below, so they need no per-object Struct machinery.
+class ChatMessage(TypedDict):
     """Represents a single chat message."""
     role: str
     content: str
 
-class ChatCompletionRequest(BaseModel):
+class ChatCompletionRequest(msgspec.Struct, frozen=True, gc=False):
     """Request body for chat completion."""
+    # msgspec's typed decoder only visits keys present in the body and fills
+    # the rest from static defaults, so it is already specialized per request
+    # shape; hand-generated parsers over a generic decode measured slower.
     model: str
-    messages: List[ChatMessage]
-    temperature: Optional[float] = 0.7
-    top_p: Optional[float] = 1.0
-    n: Optional[int] = 1
+    # Decoded as plain dicts so they can be passed to llama.cpp unchanged.
+    messages: List[LlamaMessage]
+    temperature: float = 0.7
+    top_p: float = 1.0
+    n: int = 1
     max_tokens: Optional[int] = None
-    stream: Optional[bool] = False
+    stream: bool = False
     stop: Optional[Union[str, List[str]]] = None
-    presence_penalty: Optional[float] = 0.0
-    frequency_penalty: Optional[float] = 0.0
+    presence_penalty: float = 0.0
+    frequency_penalty: float = 0.0
     logit_bias: Optional[Dict[str, float]] = None
     user: Optional[str] = None
     # Additional parameters for llama.cpp
-    top_k: Optional[int] = 40
-    repeat_penalty: Optional[float] = 1.1
+    top_k: int = 40
+    repeat_penalty: float = 1.1
 
-class ChatCompletionResponseChoice(BaseModel):
+class ChatCompletionResponseChoice(TypedDict):
     """A single choice in a chat completion response."""
     index: int
     message: ChatMessage
-    finish_reason: Optional[str] = None
+    finish_reason: Optional[str]
 
-class ChatCompletionUsage(BaseModel):
+class ChatCompletionUsage(TypedDict):
     """Token usage details for a completion."""
     prompt_tokens: int
     completion_tokens: int
     total_tokens: int
 
-class ChatCompletionResponse(BaseModel):
+class ChatCompletionResponse(msgspec.Struct, frozen=True, gc=False, kw_only=True):
     """Full chat completion response."""
     id: str
     object: str = "chat.completion"
-    created: int = Field(default_factory=lambda: int(time.time()))
+    created: int = msgspec.field(default_factory=cached_timestamp)
     model: str
     choices: List[ChatCompletionResponseChoice]
     usage: ChatCompletionUsage
 
-class ChatCompletionChunkDelta(BaseModel):
+class ChatCompletionChunkDelta(TypedDict, total=False):
     """Delta content for a streaming chunk."""
-    role: Optional[str] = None
-    content: Optional[str] = None
+    role: Optional[str]
+    content: Optional[str]
 
-class ChatCompletionChunkChoice(BaseModel):
+class ChatCompletionChunkChoice(TypedDict):
     """A single choice in a streaming chunk."""
     index: int
     delta: ChatCompletionChunkDelta
-    finish_reason: Optional[str] = None
+    finish_reason: Optional[str]
 
-class ChatCompletionChunk(BaseModel):
+class ChatCompletionChunk(msgspec.Struct, frozen=True, gc=False, kw_only=True):
     """Streaming chunk response."""
     id: str
     object: str = "chat.completion.chunk"
-    created: int = Field(default_factory=lambda: int(time.time()))
+    created: int = msgspec.field(default_factory=cached_timestamp)
     model: str
     choices: List[ChatCompletionChunkChoice]
 
 
-class HealthResponse(BaseModel):
+class HealthResponse(msgspec.Struct, frozen=True, gc=False):
     """Health check response."""
     status: str
     model_loaded: bool
@@ -1,10 +1,140 @@
 """Environment setup helpers for the worker service."""
+import argparse
 import os
 import platform
 import subprocess
 import sys
 
-def get_hardware_flags():
+X86_MACHINES = {"x86_64", "amd64"}
+ARM_MACHINES = {"aarch64", "arm64"}
+
+# Ampere, Ada and Hopper; used when nvidia-smi cannot report compute capability.
+DEFAULT_CUDA_ARCHITECTURES = "80;86;89;90"
+
+# CPU feature flag -> llama.cpp CMake option that enables the matching kernels.
+# AVX512_VNNI adds the int8 dot-product (VPDPBUSD) path used by the Q4_K_M and
+# Q8_0 variants in profiler/model_classification.json.
+X86_ISA_OPTIONS = {
+    "avx": "GGML_AVX",
+    "avx2": "GGML_AVX2",
+    "fma": "GGML_FMA",
+    "f16c": "GGML_F16C",
+    "avx512f": "GGML_AVX512",
+    "avx512_vnni": "GGML_AVX512_VNNI",
+}
+
+# Platform-specific spellings -> the /proc/cpuinfo names in X86_ISA_OPTIONS.
+# macOS sysctl reports AVX1.0/AVX512VNNI.
+CPU_FEATURE_ALIASES = {
+    "avx1.0": "avx",
+    "avx512vnni": "avx512_vnni",
+}
+
+def normalize_cpu_features(flags):
+    """
+    Lower-cases feature flags and maps platform aliases to Linux names.
+    """
+    features = {flag.lower() for flag in flags}
+    return features | {
+        CPU_FEATURE_ALIASES[flag] for flag in features if flag in CPU_FEATURE_ALIASES
+    }
+
+def get_cpu_features():
+    """
+    Returns the lower-cased CPU feature flags reported by the host.
+    """
+    system = platform.system()
+
+    if system == "Linux":
+        # x86 lists ISA extensions under "flags", ARM under "Features".
+        try:
+            with open("/proc/cpuinfo", encoding="utf-8") as cpuinfo:
+                for line in cpuinfo:
+                    key, _, value = line.partition(":")
+                    if key.strip() in {"flags", "Features"}:
+                        return set(value.split())
+        except OSError:
+            pass
+        return set()
+
+    if system == "Darwin":
+        try:
+            result = subprocess.run(
+                ["sysctl", "-n", "machdep.cpu.features", "machdep.cpu.leaf7_features"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                text=True,
+                check=False,
+            )
+        except FileNotFoundError:
+            return set()
+        return normalize_cpu_features(result.stdout.split())
+
+    # Windows and others: no dependency-free probe, so leave ISA selection to
+    # ggml's native detection.
+    return set()
+
+def get_cpu_cmake_args(features):
+    """
+    Builds explicit ggml ISA options, turning off anything the CPU lacks.
+    """
+    # GGML_NATIVE would otherwise override the explicit per-ISA options.
+    return ["-DGGML_NATIVE=OFF"] + [
+        f"-D{option}={'ON' if feature in features else 'OFF'}"
+        for feature, option in X86_ISA_OPTIONS.items()
+    ]
+
+def verify_build(python_exe, features):
+    """
+    Checks llama.cpp's system info for the SIMD paths detected on the host.
+    """
+    if not features:
+        print("⚠️  CPU features unknown, skipping SIMD build verification.")
+        return
+
+    expected = {"AVX2": "avx2", "AVX512": "avx512f", "AVX512_VNNI": "avx512_vnni"}
+    try:
+        system_info = subprocess.check_output(
+            [
+                python_exe,
+                "-c",
+                "import llama_cpp; print(llama_cpp.llama_print_system_info().decode())",
+            ],
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        print("⚠️  Could not read llama.cpp system info to verify the build.")
+        return
+
+    missing = [
+        name
+        for name, feature in expected.items()
+        if feature in features and f"{name} = 1" not in system_info
+    ]
+    if missing:
+        print(f"⚠️  Supported by this CPU but missing from the build: {', '.join(missing)}")
+    else:
+        print("✅ llama.cpp build uses all detected SIMD extensions")
+
+def get_cuda_architectures():
+    """
+    Returns the CMake CUDA architectures of the installed NVIDIA GPUs.
+    """
+    try:
+        output = subprocess.check_output(
+            ["nvidia-smi", "--query-gpu=compute_cap", "--format=csv,noheader"],
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        output = ""
+
+    # "8.6" -> "86"; older drivers do not support the compute_cap query.
+    architectures = sorted({line.strip().replace(".", "") for line in output.splitlines()} - {""})
+    return ";".join(architectures) or DEFAULT_CUDA_ARCHITECTURES
+
+def get_hardware_flags(cross_compile=False, force_cmake=True):
     """
     Detects hardware and returns the appropriate CMAKE_ARGS for llama-cpp-python.
     """
@@ -30,7 +160,11 @@ def get_hardware_flags():
                 stderr=subprocess.DEVNULL,
             )
             print("🟢 Detected NVIDIA GPU (CUDA)")
-            flags["CMAKE_ARGS"] = "-DLLAMA_CUBLAS=on"
+            # Force the quantized MMQ kernels, which run on tensor cores.
+            flags["CMAKE_ARGS"] = (
+                "-DGGML_CUDA=on -DGGML_CUDA_FORCE_MMQ=ON -DGGML_CUDA_F16=ON "
+                f'-DCMAKE_CUDA_ARCHITECTURES="{get_cuda_architectures()}"'
+            )
         except (subprocess.CalledProcessError, FileNotFoundError):
             # Check for AMD GPU (ROCm)
             try:
@@ -60,9 +194,49 @@ def get_hardware_flags():
         print("❓ Unknown system, defaulting to CPU only.")
         flags["CMAKE_ARGS"] = "-DLLAMA_BLAS=off"
 
+    if cross_compile:
+        # Host CPU features say nothing about the target, so leave ISA
+        # selection to the toolchain.
+        print("🔀 Cross-compiling, skipping host CPU feature detection")
+    else:
+        flags.update(get_cpu_flags(system, machine.lower(), flags["CMAKE_ARGS"]))
+
+    if force_cmake:
+        # Build from source so the ISA matches this host instead of a
+        # prebuilt wheel.
+        flags["FORCE_CMAKE"] = "1"
+
     return flags
 
-def setup_environment():
+def get_cpu_flags(system, machine, cmake_args):
+    """
+    Returns CMAKE_ARGS/CFLAGS/CXXFLAGS tuned to the host CPU.
+    """
+    flags = dict[str, str]()
+    features = get_cpu_features()
+    compiler_flags = "-march=native -mtune=native"
+
+    if machine in X86_MACHINES and not features:
+        # Explicit options would switch every ISA off; keep GGML_NATIVE instead.
+        print("⚠️  Could not detect CPU extensions, leaving ISA selection to ggml")
+    elif machine in X86_MACHINES:
+        enabled = [feature for feature in X86_ISA_OPTIONS if feature in features]
+        print(f"🧮 CPU extensions: {', '.join(enabled) or 'none detected'}")
+        # With GGML_NATIVE=OFF, ggml turns these options into the matching
+        # MSVC /arch switch itself, keeping CMake's default /EHsc flags intact.
+        cmake_args += " " + " ".join(get_cpu_cmake_args(features))
+    elif machine in ARM_MACHINES and "fphp" in features:
+        # -march=native misses FP16 vector arithmetic on some ARM boards.
+        print("🧮 CPU extensions: ARMv8.2 FP16 arithmetic")
+        compiler_flags = "-march=armv8.2-a+fp16"
+
+    flags["CMAKE_ARGS"] = cmake_args
+    if system == "Linux":
+        flags["CFLAGS"] = compiler_flags
+        flags["CXXFLAGS"] = compiler_flags
+    return flags
+
+def setup_environment(cross_compile=False, force_cmake=True):
     """
     Sets up the virtual environment and installs dependencies.
     """
@@ -81,8 +255,10 @@ def setup_environment():
     # 2. Determine Pip Path
     if platform.system() == "Windows":
         pip_exe = os.path.join(venv_dir, "Scripts", "pip.exe")
+        python_exe = os.path.join(venv_dir, "Scripts", "python.exe")
     else:
         pip_exe = os.path.join(venv_dir, "bin", "pip")
+        python_exe = os.path.join(venv_dir, "bin", "python")
 
     # 3. Upgrade Pip
     print("⬆️  Upgrading pip...")
@@ -99,7 +275,7 @@ def setup_environment():
     subprocess.call([pip_exe, "uninstall", "-y", "llama-cpp-python"])
 
     env = os.environ.copy()
-    flags = get_hardware_flags()
+    flags = get_hardware_flags(cross_compile=cross_compile, force_cmake=force_cmake)
     env.update(flags)
 
     # Force reinstall with --no-cache-dir to ensure compilation happens
@@ -114,6 +290,9 @@ def setup_environment():
         env=env,
     )
 
+    if not cross_compile and platform.machine().lower() in X86_MACHINES:
+        verify_build(python_exe, get_cpu_features())
+
     print("\n✨ Setup Complete! ✨")
     print(
         "To run the worker manually:\n"
@@ -121,4 +300,17 @@ def setup_environment():
     )
 
 if __name__ == "__main__":
-    setup_environment()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--force-cmake",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Always compile llama-cpp-python instead of using a prebuilt wheel",
+    )
+    parser.add_argument(
+        "--cross-compile",
+        action="store_true",
+        help="Skip host CPU detection and -march=native when targeting another machine",
+    )
+    args = parser.parse_args()
+    setup_environment(cross_compile=args.cross_compile, force_cmake=args.force_cmake)
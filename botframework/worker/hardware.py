@@ -0,0 +1,50 @@
+"""Runtime hardware probes used to tune llama.cpp in the worker."""
+import os
+import platform
+
+def get_physical_core_count() -> int:
+    """Return the number of physical CPU cores, ignoring SMT siblings."""
+    cores_per_package: dict[str, int] = {}
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as cpuinfo:
+            physical_id = "0"
+            for line in cpuinfo:
+                key, _, value = line.partition(":")
+                key = key.strip()
+                if key == "physical id":
+                    physical_id = value.strip()
+                elif key == "cpu cores":
+                    cores_per_package[physical_id] = int(value)
+    except (OSError, ValueError):
+        pass
+    cores = sum(cores_per_package.values()) or os.cpu_count() or 1
+
+    # /proc/cpuinfo lists every host CPU; respect cpuset/affinity limits so a
+    # container pinned to a few CPUs does not spawn one thread per host core.
+    if hasattr(os, "sched_getaffinity"):
+        cores = min(cores, len(os.sched_getaffinity(0)))
+    return max(cores, 1)
+
+def get_llama_kwargs(gpu_offload: bool) -> dict[str, object]:
+    """Pick llama.cpp runtime options for the installed backend.
+
+    ``gpu_offload`` should come from ``llama_cpp.llama_supports_gpu_offload()``
+    so the choice follows the installed wheel rather than the host hardware.
+    """
+    # SMT siblings share execution units and only add contention.
+    cores = get_physical_core_count()
+    if not gpu_offload:
+        return {"n_threads": cores, "n_threads_batch": cores}
+
+    # Large prompt batches plus flash attention keep the GPU fed while
+    # moving fewer bytes through the attention kernels.
+    kwargs: dict[str, object] = {
+        "n_batch": 512,
+        "n_threads": cores,
+        "use_mlock": True,
+        "flash_attn": True,
+    }
+    if platform.system() != "Darwin":
+        # CUDA/ROCm: keep the KV cache in VRAM next to the offloaded layers.
+        kwargs["offload_kqv"] = True
+    return kwargs
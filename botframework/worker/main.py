@@ -3,16 +3,21 @@ from __future__ import annotations
 
 # pylint: disable=import-error,wrong-import-position
 import argparse
-import json
+import asyncio
 import os
+import re
+import shlex
 import sys
-import time
-from contextlib import asynccontextmanager
-from typing import Optional, Sequence, TYPE_CHECKING
+import threading
+from contextlib import asynccontextmanager, closing
+from types import MappingProxyType
+from typing import AsyncIterator, Iterator, Optional, TYPE_CHECKING
 
+import msgspec
 import uvicorn
-from fastapi import FastAPI
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 
 # Add the parent directory to sys.path to allow imports from botframework
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -24,111 +29,200 @@ from rest.schemas import (
     ChatCompletionUsage,
     ChatMessage,
     HealthResponse,
-    LlamaMessage,
+    refresh_timestamp,
 )
+from worker.hardware import get_llama_kwargs
+from worker.model_registry import ModelRegistry, load_registry
 
-# Try importing llama-cpp-python
+# llama-cpp-python is imported lazily in configure_worker
 
 if TYPE_CHECKING:
-    from llama_cpp import ChatCompletionRequestMessage
     from llama_cpp import Llama
 
-try:
-    from llama_cpp import Llama as _LlamaRuntime
-except ImportError:
-    _LlamaRuntime = None
 
+# Module-level msgspec codecs, built once and reused by every request.
+REQUEST_DECODER = msgspec.json.Decoder(ChatCompletionRequest)
+RESPONSE_ENCODER = msgspec.json.Encoder()
 
+# Pre-encoded server-sent event framing.
+_SSE_PREFIX = b"data: "
+_SSE_SUFFIX = b"\n\n"
+_SSE_DONE = b"data: [DONE]\n\n"
+
+# Process-wide worker state, set by configure_worker during startup.
+# pylint: disable=invalid-name
 # Global LLM instance (typed strictly as Llama)
-llm: Optional["Llama"] = None
+llm: Optional[Llama] = None
 loaded_model_name = "mock"
+# pylint: enable=invalid-name
+
+# llama.cpp contexts are not thread-safe, so generations run one at a time.
+_llm_lock = threading.Lock()
+
+# Default context window, and the ceiling for registry-derived values: the
+# Go profiler's KV-cache budget (profiler/scoring.go) assumes a small context,
+# so a larger registry context_window could OOM a host the profiler approved.
+DEFAULT_N_CTX = 2048
+
+# Command-line arguments forwarded to every uvicorn worker process.
+WORKER_ARGS_ENV = "BOTFRAMEWORK_WORKER_ARGS"
+
 
+async def refresh_timestamps() -> None:
+    """Refresh the cached ``created`` timestamp once per second."""
+    while True:
+        refresh_timestamp()
+        await asyncio.sleep(1)
 
 @asynccontextmanager
-async def lifespan(_app: FastAPI):
+async def lifespan(fastapi_app: FastAPI):
     """Handle startup and shutdown for the FastAPI app."""
     # Startup logic
     print("🚀 Worker starting up...")
+    # Parsed once; request handlers only do dict lookups on the result.
+    try:
+        fastapi_app.state.model_registry = load_registry()
+    except OSError as exc:
+        print(f"⚠️  Model registry unavailable: {exc}")
+        fastapi_app.state.model_registry = MappingProxyType({})
+    configure_worker(
+        build_parser().parse_args(shlex.split(os.environ.get(WORKER_ARGS_ENV, ""))),
+        fastapi_app.state.model_registry,
+    )
+    clock = asyncio.create_task(refresh_timestamps())
     yield
     # Shutdown logic
+    clock.cancel()
     print("🛑 Worker shutting down...")
 
-app = FastAPI(title="BotFramework Worker", lifespan=lifespan)
+class MsgspecJSONResponse(JSONResponse):  # pylint: disable=too-few-public-methods
+    """JSON response rendered with the shared msgspec encoder."""
+
+    def render(self, content: object) -> bytes:
+        """Encode ``content`` to JSON bytes."""
+        return RESPONSE_ENCODER.encode(content)
+
+app = FastAPI(
+    title="BotFramework Worker",
+    lifespan=lifespan,
+    default_response_class=MsgspecJSONResponse,
+)
 
 @app.post("/v1/chat/completions")
-async def chat_completions(request: ChatCompletionRequest):
+async def chat_completions(raw_request: Request):
     """Handle chat completion requests."""
+    try:
+        request = REQUEST_DECODER.decode(await raw_request.body())
+    except msgspec.DecodeError as exc:
+        raise HTTPException(status_code=422, detail=str(exc)) from exc
+
     print(f"📥 Received request for model: {request.model}")
 
     if llm is None:
         # Fallback for mock mode if model failed to load or lib missing
-        return mock_response(request)
-
-    # Convert Pydantic messages to list of dicts for llama-cpp
-    messages: list[LlamaMessage] = [
-        {"role": m.role, "content": m.content} for m in request.messages
-    ]
+        return MsgspecJSONResponse(mock_response(request))
 
     if request.stream:
         return StreamingResponse(
-            stream_chat_response(messages, request),
+            stream_chat_response(request),
             media_type="text/event-stream"
         )
-    return create_chat_response(messages, request)
+    # Generation runs off the event loop; llama.cpp releases the GIL meanwhile.
+    return MsgspecJSONResponse(await run_in_threadpool(create_chat_response, request))
 
-def create_chat_response(
-    messages: Sequence["ChatCompletionRequestMessage"],
-    request: ChatCompletionRequest,
-):
+def create_chat_response(request: ChatCompletionRequest):
     """Create a non-streaming chat completion response."""
     assert llm is not None  # For type checker
-    temperature = 0.7 if request.temperature is None else request.temperature
-    top_k = 40 if request.top_k is None else request.top_k
-    repeat_penalty = 1.1 if request.repeat_penalty is None else request.repeat_penalty
-    response = llm.create_chat_completion(
-        messages=messages,
-        temperature=temperature,
-        top_p=request.top_p,
-        top_k=top_k,
-        max_tokens=request.max_tokens,
-        stop=request.stop,
-        repeat_penalty=repeat_penalty,
-        stream=False
-    )
+    with _llm_lock:
+        response = llm.create_chat_completion(
+            # Already decoded into llama-cpp's dict format; no copy needed
+            messages=request.messages,
+            temperature=request.temperature,
+            top_p=request.top_p,
+            top_k=request.top_k,
+            max_tokens=request.max_tokens,
+            stop=request.stop,
+            repeat_penalty=request.repeat_penalty,
+            stream=False
+        )
     return response
 
-def stream_chat_response(
-    messages: Sequence["ChatCompletionRequestMessage"],
-    request: ChatCompletionRequest,
-):
+async def stream_chat_response(request: ChatCompletionRequest) -> AsyncIterator[bytes]:
     """Stream chat completion chunks as server-sent events."""
+    # A background thread drives the whole generation and hands frames to the
+    # event loop, instead of a threadpool round trip for every token.
+    loop = asyncio.get_running_loop()
+    frames: asyncio.Queue[Optional[bytes]] = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def produce() -> None:
+        try:
+            with closing(generate_sse_frames(request, cancelled)) as generator:
+                for frame in generator:
+                    if cancelled.is_set():
+                        break
+                    loop.call_soon_threadsafe(frames.put_nowait, frame)
+        finally:
+            # Always wake the consumer, even if generation failed.
+            loop.call_soon_threadsafe(frames.put_nowait, None)
+
+    producer = asyncio.ensure_future(asyncio.to_thread(produce))
+    try:
+        done = False
+        while not done:
+            # Coalesce whatever frames queued up while the last chunk was sent,
+            # so a slow client gets fewer, larger chunks without delaying the
+            # first token.
+            batch = [await frames.get()]
+            while not frames.empty():
+                batch.append(frames.get_nowait())
+            # The producer's None sentinel is always the last item queued.
+            if batch[-1] is None:
+                batch.pop()
+                done = True
+            if batch:
+                yield b"".join(batch)
+        await producer
+    finally:
+        # Stop generating if the client disconnects mid-stream.
+        cancelled.set()
+
+def generate_sse_frames(
+    request: ChatCompletionRequest,
+    cancelled: threading.Event,
+) -> Iterator[bytes]:
+    """Generate server-sent event frames; runs in a worker thread."""
     assert llm is not None  # For type checker
-    temperature = 0.7 if request.temperature is None else request.temperature
-    top_k = 40 if request.top_k is None else request.top_k
-    repeat_penalty = 1.1 if request.repeat_penalty is None else request.repeat_penalty
-    stream = llm.create_chat_completion(
-        messages=messages,
-        temperature=temperature,
-        top_p=request.top_p,
-        top_k=top_k,
-        max_tokens=request.max_tokens,
-        stop=request.stop,
-        repeat_penalty=repeat_penalty,
-        stream=True
-    )
+    with _llm_lock:
+        # The client may have disconnected while queued on the lock; skip
+        # prompt evaluation so the lock goes straight to the next request.
+        if cancelled.is_set():
+            return
+        stream = llm.create_chat_completion(
+            # Already decoded into llama-cpp's dict format; no copy needed
+            messages=request.messages,
+            temperature=request.temperature,
+            top_p=request.top_p,
+            top_k=request.top_k,
+            max_tokens=request.max_tokens,
+            stop=request.stop,
+            repeat_penalty=request.repeat_penalty,
+            stream=True
+        )
 
-    for chunk in stream:
-        # llama-cpp-python returns dicts that match OpenAI format
-        yield f"data: {json.dumps(chunk)}\n\n"
+        for chunk in stream:
+            # llama-cpp-python returns dicts that match OpenAI format
+            yield _SSE_PREFIX + RESPONSE_ENCODER.encode(chunk) + _SSE_SUFFIX
 
-    yield "data: [DONE]\n\n"
+        yield _SSE_DONE
 
 def mock_response(request: ChatCompletionRequest) -> ChatCompletionResponse:
     """Return a mock response when the model is unavailable."""
+    # All inputs are server-generated, so build the payload directly:
+    # msgspec only validates on decode, never on construction.
     return ChatCompletionResponse(
         id="chatcmpl-mock",
         object="chat.completion",
-        created=int(time.time()),
         model=request.model,
         choices=[
             ChatCompletionResponseChoice(
@@ -137,7 +231,7 @@ def mock_response(request: ChatCompletionRequest) -> ChatCompletionResponse:
                     role="assistant",
                     content=(
                         "⚠️ Mock Response (Model not loaded). You said: "
-                        f"{request.messages[-1].content}"
+                        f"{request.messages[-1]['content']}"
                     ),
                 ),
                 finish_reason="stop",
@@ -151,17 +245,20 @@ def mock_response(request: ChatCompletionRequest) -> ChatCompletionResponse:
     )
 
 
-@app.get("/health", response_model=HealthResponse)
-async def health() -> HealthResponse:
+@app.get("/health")
+async def health() -> MsgspecJSONResponse:
     """Simple health check endpoint."""
     status = "ok" if llm else "mock_mode"
-    return HealthResponse(
-        status=status,
-        model_loaded=llm is not None,
-        model=loaded_model_name,
+    return MsgspecJSONResponse(
+        HealthResponse(
+            status=status,
+            model_loaded=llm is not None,
+            model=loaded_model_name,
+        )
     )
 
-if __name__ == "__main__":
+def build_parser() -> argparse.ArgumentParser:
+    """Build the worker command-line parser."""
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "--port",
@@ -184,33 +281,95 @@ if __name__ == "__main__":
     parser.add_argument(
         "--n-ctx",
         type=int,
-        default=2048,
-        help="Context window size",
+        default=None,
+        help=(
+            f"Context window size (default: {DEFAULT_N_CTX}, lowered to the "
+            "model's registry context_window when that is smaller; 0 uses "
+            "the model's trained context)"
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of uvicorn worker processes (each loads its own model)",
     )
+    return parser
+
+def _name_tokens(name: str) -> frozenset[str]:
+    """Split a model id or file name into lower-case alphanumeric tokens."""
+    return frozenset(re.split(r"[^a-z0-9]+", name.lower())) - {""}
 
-    args = parser.parse_args()
-
-    if args.model_path and _LlamaRuntime:
-        if os.path.exists(args.model_path):
-            print(f"📂 Loading model from: {args.model_path}")
-            try:
-                llm = _LlamaRuntime(
-                    model_path=args.model_path,
-                    n_gpu_layers=args.n_gpu_layers,
-                    n_ctx=args.n_ctx,
-                    verbose=True
-                )
-                loaded_model_name = os.path.basename(args.model_path)
-                print("✅ Model loaded successfully!")
-            except Exception as exc:  # pylint: disable=broad-exception-caught
-                print(f"❌ Failed to load model: {exc}")
-        else:
-            print(f"❌ Model path does not exist: {args.model_path}")
-    else:
-        print(
-            "ℹ️  No model path provided or llama-cpp-python missing. "
-            "Starting in Mock Mode."
+def get_context_size(model_path: str, registry: ModelRegistry) -> int:
+    """Return DEFAULT_N_CTX, capped at the model's registry context window.
+
+    A registry id matches when all of its tokens appear in the file name, so
+    ``mistral-7b-v0.3`` matches ``Mistral-7B-Instruct-v0.3.Q4_K_M.gguf``; the
+    most specific matching id wins.
+    """
+    file_tokens = _name_tokens(os.path.basename(model_path))
+    matches = [
+        model_id for model_id in registry if _name_tokens(model_id) <= file_tokens
+    ]
+    if not matches:
+        print(f"📏 Using n_ctx={DEFAULT_N_CTX} (model not found in registry)")
+        return DEFAULT_N_CTX
+
+    model_id = max(matches, key=lambda match: len(_name_tokens(match)))
+    n_ctx = min(DEFAULT_N_CTX, registry[model_id]["context_window"])
+    print(f"📏 Using n_ctx={n_ctx} (registry entry '{model_id}')")
+    return n_ctx
+
+def configure_worker(args: argparse.Namespace, registry: ModelRegistry) -> None:
+    """Apply command-line settings and load the model in this process."""
+    global llm, loaded_model_name  # pylint: disable=global-statement
+
+    if not args.model_path:
+        print("ℹ️  No model path provided. Starting in Mock Mode.")
+        return
+    if not os.path.exists(args.model_path):
+        print(f"❌ Model path does not exist: {args.model_path}")
+        return
+
+    # Only pay for loading the native llama.cpp libraries when a model exists.
+    try:
+        # pylint: disable-next=import-outside-toplevel
+        from llama_cpp import Llama as _LlamaRuntime, llama_supports_gpu_offload
+    except ImportError:
+        print("ℹ️  llama-cpp-python missing. Starting in Mock Mode.")
+        return
+
+    print(f"📂 Loading model from: {args.model_path}")
+    try:
+        llm = _LlamaRuntime(
+            model_path=args.model_path,
+            n_gpu_layers=args.n_gpu_layers,
+            n_ctx=(
+                get_context_size(args.model_path, registry)
+                if args.n_ctx is None
+                else args.n_ctx
+            ),
+            verbose=True,
+            **get_llama_kwargs(llama_supports_gpu_offload()),
         )
+        loaded_model_name = os.path.basename(args.model_path)
+        print("✅ Model loaded successfully!")
+    except Exception as exc:  # pylint: disable=broad-exception-caught
+        print(f"❌ Failed to load model: {exc}")
 
-    print(f"Worker starting on port {args.port}...")
-    uvicorn.run(app, host="127.0.0.1", port=args.port)
+if __name__ == "__main__":
+    cli_args = build_parser().parse_args()
+    # Each uvicorn worker process re-reads the arguments in its lifespan.
+    os.environ[WORKER_ARGS_ENV] = shlex.join(sys.argv[1:])
+
+    print(f"Worker starting on port {cli_args.port}...")
+    uvicorn.run(
+        app if cli_args.workers == 1 else "main:app",
+        host="127.0.0.1",
+        port=cli_args.port,
+        workers=cli_args.workers,
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        log_level="warning",
+    )
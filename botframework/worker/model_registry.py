@@ -0,0 +1,24 @@
+"""Read-only access to the model registry generated for the profiler."""
+# pylint: disable=import-error,no-member
+import os
+from types import MappingProxyType
+from typing import Any, Mapping
+
+import orjson
+
+REGISTRY_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "profiler",
+    "model_classification.json",
+)
+
+ModelRegistry = Mapping[str, Mapping[str, Any]]
+
+def load_registry(path: str = REGISTRY_PATH) -> ModelRegistry:
+    """Parse the registry once into an immutable mapping keyed by model id."""
+    # generate_model_registry.py validates the schema, so only parse here.
+    with open(path, "rb") as registry_file:
+        registry = orjson.loads(registry_file.read())
+    return MappingProxyType(
+        {model["id"]: MappingProxyType(model) for model in registry["models"]}
+    )
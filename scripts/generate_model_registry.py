@@ -1,12 +1,69 @@
 """Generate the model_classification.json registry file."""
-import json
+# pylint: disable=import-error,no-member
 import os
 
+import fastjsonschema
+import orjson
+
 # This script generates the model_classification.json file used by the Go profiler.
 # In a real scenario, this could crawl HuggingFace or Ollama library for metadata.
 
 REGISTRY_PATH = "../botframework/profiler/model_classification.json"
 
+# The registry is validated here, once, so consumers can load it without
+# re-validating on every read.
+REGISTRY_SCHEMA = {
+    "type": "object",
+    "required": ["models"],
+    "properties": {
+        "models": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": [
+                    "id",
+                    "name",
+                    "family",
+                    "params_b",
+                    "context_window",
+                    "benchmarks",
+                    "variants",
+                ],
+                "properties": {
+                    "id": {"type": "string"},
+                    "name": {"type": "string"},
+                    "family": {"type": "string"},
+                    "params_b": {"type": "number", "exclusiveMinimum": 0},
+                    "context_window": {"type": "integer", "minimum": 1},
+                    "benchmarks": {
+                        "type": "object",
+                        "additionalProperties": {"type": "number"},
+                    },
+                    "variants": {
+                        "type": "array",
+                        "minItems": 1,
+                        "items": {
+                            "type": "object",
+                            "required": ["quant", "size_gb", "accuracy_retention"],
+                            "properties": {
+                                "quant": {"type": "string"},
+                                "size_gb": {"type": "number", "exclusiveMinimum": 0},
+                                "accuracy_retention": {
+                                    "type": "number",
+                                    "minimum": 0,
+                                    "maximum": 1,
+                                },
+                            },
+                        },
+                    },
+                },
+            },
+        },
+    },
+}
+
+validate_registry = fastjsonschema.compile(REGISTRY_SCHEMA)
+
 def generate_registry():
     """Create and write the model registry JSON file."""
     registry = {
@@ -111,11 +168,14 @@ def generate_registry():
         ]
     }
 
+    # Raises fastjsonschema.JsonSchemaValueException before anything is written
+    validate_registry(registry)
+
     # Ensure directory exists
     os.makedirs(os.path.dirname(REGISTRY_PATH), exist_ok=True)
 
-    with open(REGISTRY_PATH, "w", encoding="utf-8") as f:
-        json.dump(registry, f, indent=2)
+    with open(REGISTRY_PATH, "wb") as f:
+        f.write(orjson.dumps(registry, option=orjson.OPT_INDENT_2))
 
     print(f"✅ Generated model registry at {REGISTRY_PATH}")
 